@@ -0,0 +1,70 @@
+"""
+Added ranking CPU of fusing the popularity prior into BM25 scores.
+
+    python -m benchmarks.bench_prior_fusion [--data data/fashion_products_dataset.json]
+
+Ranks every query from scratch (no retained hits) with the prior off and on,
+alternating the two engines every round and reporting the median round.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_result_pages import QUERIES, synthetic_corpus
+from myapp.analytics.popularity import normalize_query, write_prior
+from myapp.search.search_engine import SearchEngine
+
+
+def cpu_per_query(engine, corpus):
+    start = time.process_time()
+    for q in QUERIES:
+        engine._result_cache.clear()
+        engine.search_page(q, corpus, limit=20)
+    return (time.process_time() - start) / len(QUERIES) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", help="path to the products JSON file")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.data:
+        from myapp.search.load_corpus import load_corpus
+        corpus = load_corpus(args.data)
+    else:
+        corpus = synthetic_corpus()
+
+    pids = list(corpus)
+    rnd = random.Random(0)
+    prior = np.random.default_rng(0).random(len(pids), dtype=np.float32)
+    head_ctr = {normalize_query(q): {rnd.choice(pids): rnd.random() for _ in range(10)}
+                for q in QUERIES}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        meta_path = write_prior(prior, pids, head_ctr, os.path.join(tmp, "popularity_prior.json"))
+
+        plain = SearchEngine()
+        fused = SearchEngine(prior_path=meta_path)
+        plain._build_index(corpus)
+        fused._build_index(corpus)
+        fused.load_prior()
+
+        rounds = [(cpu_per_query(plain, corpus), cpu_per_query(fused, corpus))
+                  for _ in range(args.repeat)]
+        base = statistics.median(r[0] for r in rounds)
+        with_prior = statistics.median(r[1] for r in rounds)
+
+    print(f"corpus: {len(corpus)} docs, {len(QUERIES)} queries x {args.repeat} rounds")
+    print(f"BM25 only      : {base:8.3f} CPU ms/query")
+    print(f"BM25 + prior   : {with_prior:8.3f} CPU ms/query")
+    print(f"added cost     : {with_prior - base:8.3f} ms ({(with_prior - base) / base:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
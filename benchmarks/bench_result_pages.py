@@ -0,0 +1,107 @@
+"""
+Per-request CPU time of the result page paths for page sizes 10, 50 and 200.
+
+    python -m benchmarks.bench_result_pages [--data data/fashion_products_dataset.json]
+
+Without --data a synthetic corpus is generated so the benchmark runs anywhere.
+"""
+import argparse
+import json
+import random
+import time
+
+from myapp.search.objects import Document
+from myapp.search.search_engine import SearchEngine
+
+PAGE_SIZES = (10, 50, 200)
+QUERIES = ["cotton shirt", "women dress", "black shoes men", "printed t shirt",
+           "sports jacket", "casual jeans", "blue kurta", "running shoes"]
+WORDS = ("cotton shirt women men dress black blue white shoes printed t jacket "
+         "sports casual jeans kurta running slim fit solid round neck full sleeve "
+         "regular denim polyester comfortable stylish party wear").split()
+
+
+def synthetic_corpus(n_docs=20000, seed=42):
+    rnd = random.Random(seed)
+    corpus = {}
+    for i in range(n_docs):
+        pid = f"P{i:07d}"
+        corpus[pid] = Document(
+            pid=pid,
+            title=" ".join(rnd.choices(WORDS, k=6)),
+            description=" ".join(rnd.choices(WORDS, k=40)),
+            brand=rnd.choice(["acme", "zeta", "nova"]),
+            category="Clothing and Accessories",
+            sub_category=rnd.choice(["Topwear", "Bottomwear", "Footwear"]),
+            selling_price=str(rnd.randint(199, 2999)),
+            discount=f"{rnd.randint(0, 70)}% off",
+            average_rating=str(round(rnd.uniform(1, 5), 1)),
+            url=f"https://example.com/{pid}",
+            images=[f"https://example.com/img/{pid}_{k}.jpg" for k in range(4)],
+        )
+    return corpus
+
+
+def cpu_per_request(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for q in QUERIES:
+            fn(q)
+    return (time.process_time() - start) / (repeat * len(QUERIES)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", help="path to the products JSON file")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.data:
+        from myapp.search.load_corpus import load_corpus
+        corpus = load_corpus(args.data)
+    else:
+        corpus = synthetic_corpus()
+
+    engine = SearchEngine()
+    engine._build_index(corpus)
+
+    def cold(fn):
+        # drop the retained hits so every request pays for scoring
+        def run(q):
+            engine._result_cache.clear()
+            return fn(q)
+        return run
+
+    def warm(fn):
+        # run every query once so only page selection + serialization is timed
+        for q in QUERIES:
+            fn(q)
+        return fn
+
+    print(f"corpus: {len(corpus)} docs, {len(QUERIES)} queries x {args.repeat} rounds")
+    print(f"{'page':>5} | {'ResultItem+dump':>16} | {'records+json':>13} | "
+          f"{'records warm':>13} | {'last page':>14}   (CPU ms/request)")
+
+    for size in PAGE_SIZES:
+        def items(q):
+            page = engine.search_page(q, corpus, limit=size)
+            return [r.model_dump_json() for r in engine.hydrate(page.hits, None, q, corpus)]
+
+        def records(q):
+            page = engine.search_page(q, corpus, limit=size)
+            return json.dumps(engine.to_records(page.hits, None, q, corpus))
+
+        # past MAX_RETAINED_HITS, so rescored on every request
+        def deep(q):
+            total = engine.search_page(q, corpus, limit=0).total
+            page = engine.search_page(q, corpus, offset=max(0, total - size), limit=size)
+            return json.dumps(engine.to_records(page.hits, None, q, corpus))
+
+        print(f"{size:>5} | {cpu_per_request(cold(items), args.repeat):>16.3f} | "
+              f"{cpu_per_request(cold(records), args.repeat):>13.3f} | "
+              f"{cpu_per_request(warm(records), args.repeat):>13.3f} | "
+              f"{cpu_per_request(deep, args.repeat):>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,7 @@ class AnalyticsData:
             json.dump(data, f, indent=4)
 
     # -----------------------------------
-    # Record a query
+    # Record a query, returns its search id (position in the query log)
     def record_query(self, query):
         data = self._load()
         data["queries"].append({
@@ -33,12 +33,15 @@ class AnalyticsData:
             "timestamp": datetime.now().isoformat()
         })
         self._save(data)
+        return len(data["queries"]) - 1
 
-    # Record a click
-    def record_click(self, pid):
+    # Record a click (query / search_id = search that led to it, used for click-through)
+    def record_click(self, pid, query=None, search_id=None):
         data = self._load()
         data["clicks"].append({
             "pid": pid,
+            "query": query,
+            "search_id": search_id,
             "timestamp": datetime.now().isoformat()
         })
         self._save(data)
@@ -0,0 +1,167 @@
+"""
+Offline job turning the click / query log into a popularity prior for ranking.
+
+    python -m myapp.analytics.popularity [--interval 3600]
+
+Writes a versioned `.npy` array (one float32 per document, in corpus order) and a
+small JSON metadata file pointing to it. The metadata file is replaced atomically
+and last, so a running SearchEngine picks up the new prior on its next mtime check.
+"""
+import os
+import json
+import math
+import time
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+from myapp.analytics.analytics_data import ANALYTICS_FILE
+from myapp.search.search_engine import normalize_query
+
+PRIOR_META_FILE = os.path.join("data", "popularity_prior.json")
+KEEP_ARRAYS = 3   # older array versions kept for engines still mapping them
+
+
+def build_prior(analytics: dict, pids: list, half_life_days: float = 14.0,
+                head_queries: int = 100, now: datetime = None):
+    """
+    Compute the per-document prior and the head-query click-through table.
+
+    Click-through (CTR) is decayed clicks over decayed searches, both with the same
+    half-life. A search counts at most one click per document. Only queries logged
+    since clicks started recording their query are counted, so older clicks do not
+    bias CTR low. Clicks without a search_id cannot be de-duplicated, so CTR is
+    clamped to 1.
+
+    :param analytics: parsed analytics log ({"queries": [...], "clicks": [...]})
+    :param pids: document ids, in the order the array is written
+    :param half_life_days: a click or search loses half of its weight after this many days
+    :param head_queries: number of most frequent queries to keep click-through for
+    :return: (prior float32 array in [0, 1], {query: {pid: ctr}})
+    """
+    now = now or datetime.now()
+    row = {pid: i for i, pid in enumerate(pids)}
+
+    def decay(timestamp):
+        age_days = (now - datetime.fromisoformat(timestamp)).total_seconds() / 86400
+        return 0.5 ** (max(age_days, 0.0) / half_life_days)
+
+    clicks = analytics.get("clicks", [])
+
+    # --- decayed click counts ---
+    decayed = np.zeros(len(pids), dtype=np.float64)
+    for click in clicks:
+        i = row.get(click.get("pid"))
+        if i is not None:
+            decayed[i] += decay(click["timestamp"])
+
+    # log-damped and scaled to [0, 1] so one viral product does not dominate
+    top = decayed.max() if len(decayed) else 0.0
+    prior = np.log1p(decayed) / math.log1p(top) if top > 0 else decayed
+    prior = prior.astype(np.float32)
+
+    # --- click-through for head queries ---
+    attributed = [c for c in clicks if "query" in c]
+    if not attributed:
+        return prior, {}
+    since = min(datetime.fromisoformat(c["timestamp"]) for c in attributed)
+
+    searches = defaultdict(float)
+    for q in analytics.get("queries", []):
+        key = normalize_query(q["query"])
+        if key and datetime.fromisoformat(q["timestamp"]) >= since:
+            searches[key] += decay(q["timestamp"])
+    head = dict(sorted(searches.items(), key=lambda x: x[1], reverse=True)[:head_queries])
+
+    seen = set()
+    query_clicks = defaultdict(lambda: defaultdict(float))
+    for click in attributed:
+        key = normalize_query(click["query"] or "")
+        pid = click.get("pid")
+        if key not in head or pid not in row:
+            continue
+        if click.get("search_id") is not None:
+            if (click["search_id"], pid) in seen:
+                continue
+            seen.add((click["search_id"], pid))
+        query_clicks[key][pid] += decay(click["timestamp"])
+
+    head_ctr = {
+        q: {pid: min(1.0, n / head[q]) for pid, n in clicks.items()}
+        for q, clicks in query_clicks.items()
+    }
+    return prior, head_ctr
+
+
+def write_prior(prior, pids: list, head_ctr: dict, meta_path: str = PRIOR_META_FILE, **info):
+    """
+    Write a new prior version next to `meta_path` and swap the metadata file in atomically.
+    """
+    folder = os.path.dirname(meta_path) or "."
+    stem = os.path.splitext(os.path.basename(meta_path))[0]
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")   # new file per version, never overwritten
+    array_name = f"{stem}-{version}.npy"
+
+    np.save(os.path.join(folder, array_name), np.asarray(prior, dtype=np.float32))
+
+    meta = {
+        "version": version,
+        "array": array_name,
+        "generated_at": datetime.now().isoformat(),
+        "pids": list(pids),
+        "head_ctr": head_ctr,
+        **info,
+    }
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+    # drop old versions, keeping a few for engines that still have them mapped
+    old = sorted(name for name in os.listdir(folder)
+                 if name.startswith(f"{stem}-") and name.endswith(".npy") and name != array_name)
+    for name in old[:-(KEEP_ARRAYS - 1) or None]:
+        os.remove(os.path.join(folder, name))
+
+    return meta_path
+
+
+def run_once(corpus_path, analytics_path=ANALYTICS_FILE, meta_path=PRIOR_META_FILE,
+             half_life_days=14.0, head_queries=100):
+    from myapp.search.load_corpus import load_corpus
+
+    pids = list(load_corpus(corpus_path).keys())
+    with open(analytics_path, "r", encoding="utf-8") as f:
+        analytics = json.load(f)
+
+    prior, head_ctr = build_prior(analytics, pids, half_life_days, head_queries)
+    write_prior(prior, pids, head_ctr, meta_path,
+                half_life_days=half_life_days, head_queries=head_queries)
+    print(f"Popularity prior written to {meta_path} "
+          f"({int((prior > 0).sum())} docs with clicks, {len(head_ctr)} head queries)")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", default=os.getenv("DATA_FILE_PATH"), help="products JSON file")
+    parser.add_argument("--analytics", default=ANALYTICS_FILE)
+    parser.add_argument("--out", default=os.getenv("PRIOR_FILE_PATH", PRIOR_META_FILE))
+    parser.add_argument("--half-life", type=float, default=14.0, help="click half-life in days")
+    parser.add_argument("--head", type=int, default=100, help="head queries with click-through")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="rebuild every N seconds (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        run_once(args.data, args.analytics, args.out, args.half_life, args.head)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
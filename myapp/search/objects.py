@@ -1,5 +1,5 @@
 from pydantic import BaseModel, field_validator
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, NamedTuple
 from datetime import datetime
 import re
 
@@ -126,3 +126,22 @@ class ResultItem(BaseModel):
     def to_json(self):
         return self.model_dump_json()
 
+
+class RankedHit(NamedTuple):
+    """
+    Lightweight ranked hit (pid + BM25 score), hydrated into a ResultItem only when displayed
+    """
+    pid: str
+    score: float
+
+
+class ResultPage(NamedTuple):
+    """
+    One page of ranked hits for a query
+    """
+    hits: List[RankedHit]
+    total: int
+    offset: int
+    next_offset: Optional[int]
+    # identifies the ranking the page was cut from (changes when a new popularity prior is loaded)
+    ranking_version: str = "bm25"
@@ -1,128 +1,335 @@
+import os
 import re
+import json
 import math
-from collections import defaultdict, Counter
+import time
+from urllib.parse import urlencode
+from collections import defaultdict, Counter, OrderedDict
 
-from myapp.search.objects import Document, ResultItem
+import numpy as np
+
+from myapp.search.objects import Document, ResultItem, RankedHit, ResultPage
+
+
+# ---------- Text processing ----------
+
+def tokenize(text: str):
+    text = (text or "").lower()
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def normalize_query(query: str):
+    """Canonical query key, shared by the result cache and head-query click-through."""
+    return " ".join(tokenize(query))
 
 
 class SearchEngine:
     """BM25 search over the product corpus (cached in memory)."""
 
-    def __init__(self):
+    # Retained hits are (ordinal, score) arrays, 16 bytes per hit, so the cache holds
+    # at most RESULT_CACHE_SIZE * MAX_RETAINED_HITS * 16 bytes (~20 MB).
+    RESULT_CACHE_SIZE = 128      # queries whose ranked hits are retained
+    MIN_DEPTH = 50               # hits kept per query on first ranking
+    MAX_RETAINED_HITS = 10000    # deeper pages are selected on every request
+    PRIOR_CHECK_INTERVAL = 5.0   # seconds between checks for a new popularity prior
+
+    def __init__(self, prior_path: str = None, prior_weight: float = 1.0, ctr_weight: float = 1.0):
+        """
+        :param prior_path: metadata file written by myapp.analytics.popularity (optional)
+        :param prior_weight: weight of the decayed-click prior added to BM25 scores
+        :param ctr_weight: weight of the per-query click-through for head queries
+        """
         self._indexed = False
-        self._index = defaultdict(list)   # term -> [(pid, tf), ...]
+        self._index = {}                  # term -> (doc ordinals, tfs) arrays
         self._idf = {}
-        self._doc_len = {}
+        self._doc_len = np.zeros(0)       # ordinal -> document length
         self._avgdl = 0.0
         self._N = 0
+        self._doc_ids = []                # ordinal -> pid (corpus order)
+        self._doc_ord = {}                # pid -> ordinal
+        # normalized query -> (top-k ordinals, their scores, total matches), LRU-ordered
+        self._result_cache = OrderedDict()
 
-    # ---------- Text processing ----------
-
-    def _tokenize(self, text: str):
-        text = (text or "").lower()
-        return re.findall(r"[a-z0-9]+", text)
+        self.prior_path = prior_path
+        self.prior_weight = prior_weight
+        self.ctr_weight = ctr_weight
+        # (values aligned to ordinals, {query: (ordinals, ctr)}, mtime)
+        self._prior = None
+        self._prior_checked = 0.0
+        self._prior_seen_mtime = None     # metadata mtime last tried, loaded or not
+        self._ranking_version = "bm25"
 
     # ---------- Index building ----------
 
     def _build_index(self, corpus: dict):
         """
         Build an in-memory BM25 index from the corpus of Document objects.
+        Documents are numbered by corpus order; postings and lengths are numpy arrays
+        indexed by that ordinal so scoring can accumulate into a dense array.
         """
         self._index.clear()
         self._idf.clear()
-        self._doc_len.clear()
+        self._result_cache.clear()
+        self._doc_ids = [str(pid) for pid in corpus]
+        self._doc_ord = {pid: i for i, pid in enumerate(self._doc_ids)}
+        self._prior = None
+        self._prior_checked = 0.0
+        self._prior_seen_mtime = None
+        self._ranking_version = "bm25"
 
-        df_counts = Counter()
+        postings = defaultdict(lambda: ([], []))
         self._N = len(corpus)
         lengths = []
 
-        for pid, doc in corpus.items():
+        for ordinal, doc in enumerate(corpus.values()):
             title = getattr(doc, "title", "") or ""
             desc = getattr(doc, "description", "") or ""
             brand = getattr(doc, "brand", "") or ""
             category = getattr(doc, "category", "") or ""
             subcat = getattr(doc, "sub_category", "") or ""
 
-            tokens = self._tokenize(f"{title} {desc} {brand} {category} {subcat}")
+            tokens = tokenize(f"{title} {desc} {brand} {category} {subcat}")
             counts = Counter(tokens)
 
-            dl = sum(counts.values())
-            self._doc_len[str(pid)] = dl
-            lengths.append(dl)
+            lengths.append(sum(counts.values()))
 
             for term, tf in counts.items():
-                self._index[term].append((str(pid), tf))
-                df_counts[term] += 1
+                ords, tfs = postings[term]
+                ords.append(ordinal)
+                tfs.append(tf)
 
-        self._avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self._doc_len = np.asarray(lengths, dtype=np.float64)
+        self._avgdl = float(self._doc_len.mean()) if lengths else 0.0
 
-        # BM25-style IDF
-        for term, dfi in df_counts.items():
+        for term, (ords, tfs) in postings.items():
+            self._index[term] = (np.asarray(ords, dtype=np.intp), np.asarray(tfs, dtype=np.float64))
+
+            # BM25-style IDF
+            dfi = len(ords)
             self._idf[term] = math.log((self._N - dfi + 0.5) / (dfi + 0.5) + 1)
 
         self._indexed = True
 
     # ---------- BM25 scoring ----------
 
-    def _bm25_scores(self, terms, candidates, k1=1.5, b=0.75):
-        scores = defaultdict(float)
+    def _bm25_scores(self, terms, k1=1.5, b=0.75):
+        """
+        Score every document containing any of the terms (soft matching).
+        :return: (dense scores indexed by ordinal, ordinals of the matching docs)
+        """
+        scores = np.zeros(self._N)
+        matched = np.zeros(self._N, dtype=bool)
         for t in terms:
             if t not in self._index:
                 continue
-            idf_t = self._idf.get(t, 0.0)
-            for pid, tf in self._index[t]:
-                if pid not in candidates:
-                    continue
-                dl = self._doc_len.get(pid, 1)
-                denom = tf + k1 * (1 - b + b * (dl / (self._avgdl or 1)))
-                scores[pid] += idf_t * (tf * (k1 + 1)) / denom
-        return scores
+            ords, tf = self._index[t]
+            denom = tf + k1 * (1 - b + b * (self._doc_len[ords] / (self._avgdl or 1)))
+            scores[ords] += self._idf[t] * (tf * (k1 + 1)) / denom
+            matched[ords] = True
+        return scores, np.flatnonzero(matched)
 
-    # ---------- Public search API ----------
+    # ---------- Popularity prior ----------
 
-    def search(self, search_query: str, search_id: int, corpus: dict, num_results: int = 20):
+    def load_prior(self, meta_path: str = None):
         """
-        Main entry point used from web_app.py.
+        Memory-map the prior array referenced by `meta_path` and swap it in.
+        If it was built for a different document order, it is realigned once here.
+        Raises ValueError for a malformed prior; the current prior is then kept.
+        """
+        meta_path = meta_path or self.prior_path
+        mtime = os.stat(meta_path).st_mtime_ns
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if (not isinstance(meta, dict) or not isinstance(meta.get("array"), str)
+                or not isinstance(meta.get("pids"), list)
+                or not isinstance(meta.get("head_ctr", {}), dict)
+                or not all(isinstance(ctr, dict) for ctr in meta.get("head_ctr", {}).values())):
+            raise ValueError(f"malformed prior metadata in {meta_path}")
+
+        array_path = os.path.join(os.path.dirname(meta_path), meta["array"])
+        values = np.load(array_path, mmap_mode="r")
+        if values.ndim != 1 or len(values) != len(meta["pids"]):
+            raise ValueError(f"prior array {meta['array']} has shape {values.shape}, "
+                             f"expected {len(meta['pids'])} values")
+
+        if meta["pids"] != self._doc_ids:
+            row = {pid: i for i, pid in enumerate(meta["pids"])}
+            src = np.fromiter((row.get(pid, -1) for pid in self._doc_ids),
+                              dtype=np.intp, count=len(self._doc_ids))
+            found = src >= 0
+            aligned = np.zeros(len(self._doc_ids), dtype=np.float32)
+            aligned[found] = values[src[found]]
+            values = aligned
+
+        head_ctr = {}
+        for query, ctr in meta.get("head_ctr", {}).items():
+            ctr = {self._doc_ord[pid]: value for pid, value in ctr.items() if pid in self._doc_ord}
+            if ctr:
+                head_ctr[query] = (np.fromiter(ctr.keys(), dtype=np.intp, count=len(ctr)),
+                                   np.fromiter(ctr.values(), dtype=np.float64, count=len(ctr)))
+
+        # single assignment, so concurrent searches see either the old or the new prior
+        self._prior = (values, head_ctr, mtime)
+        self._ranking_version = f"prior-{meta.get('version')}"
+        self._result_cache.clear()
+        print(f"Popularity prior loaded: version {meta.get('version')}")
+
+    def _maybe_reload_prior(self):
+        """Hot-swap the prior when its metadata file changed (checked at most every few seconds)."""
+        now = time.monotonic()
+        if not self.prior_path or now - self._prior_checked < self.PRIOR_CHECK_INTERVAL:
+            return
+        self._prior_checked = now
+
+        try:
+            mtime = os.stat(self.prior_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._prior_seen_mtime:
+            return
+        self._prior_seen_mtime = mtime
+
+        try:
+            self.load_prior(self.prior_path)
+        except Exception as e:
+            # a bad prior file must never break search: keep ranking with the current one
+            print(f"Error loading popularity prior: {e}")
+
+    def _fuse_prior(self, query_key, scores):
+        """
+        Add prior_weight * prior and, for head queries, ctr_weight * click-through
+        to the dense BM25 scores (in place). The whole array is updated, which is
+        cheaper than gathering the candidates; only matching docs are ranked anyway.
+        """
+        values, head_ctr, _ = self._prior
+
+        if self.prior_weight:
+            scores += self.prior_weight * values
+
+        ctr = head_ctr.get(query_key)
+        if ctr is not None and self.ctr_weight:
+            ords, ctr_values = ctr
+            scores[ords] += self.ctr_weight * ctr_values
+
+    # ---------- Ranked hits (retained per query) ----------
+
+    @staticmethod
+    def _top_mask(cand_scores, n):
+        """
+        Boolean mask of the n best candidates. Docs tied with the n-th score are
+        taken in corpus order (candidates are sorted by ordinal).
+        """
+        if n >= len(cand_scores):
+            return np.ones(len(cand_scores), dtype=bool)
+        kth = cand_scores[np.argpartition(-cand_scores, n - 1)[n - 1]]
+        mask = cand_scores > kth
+        tied = np.flatnonzero(cand_scores == kth)
+        mask[tied[:n - np.count_nonzero(mask)]] = True
+        return mask
+
+    def _score_range(self, query_key, start, stop):
+        """
+        Score the query and select the docs ranked [start, stop), sorted by rank.
+        :return: (ordinals, scores, total matches)
+        """
+        scores, candidates = self._bm25_scores(query_key.split())
+        if self._prior is not None:
+            self._fuse_prior(query_key, scores)
+        cand_scores = scores[candidates]
+
+        selected = self._top_mask(cand_scores, stop)
+        if start:
+            selected &= ~self._top_mask(cand_scores, start)
+        top = np.flatnonzero(selected)
+        top = top[np.lexsort((candidates[top], -cand_scores[top]))]
+        return candidates[top], cand_scores[top], len(candidates)
+
+    def _ranked_range(self, query_key, start, stop):
+        """
+        Return (ordinals, scores, total) for the docs ranked [start, stop).
+
+        The top-k ordinals and scores are retained per query. A page past them
+        rescores the query with a larger k, retained again up to MAX_RETAINED_HITS.
+        Deeper pages select only their own ranks, so they are never materialized
+        beyond the requested slice.
+        """
+        key = query_key
+        entry = self._result_cache.get(key)
+
+        if entry is not None:
+            ords, scores, total = entry
+            if len(ords) >= min(stop, total):
+                self._result_cache.move_to_end(key)
+                return ords[start:stop], scores[start:stop], total
+
+        retained = len(entry[0]) if entry is not None else 0
+        k = max(stop, min(max(2 * retained, self.MIN_DEPTH), self.MAX_RETAINED_HITS))
+        if k > self.MAX_RETAINED_HITS:
+            return self._score_range(query_key, start, stop)
+
+        ords, scores, total = self._score_range(query_key, 0, k)
+        self._result_cache[key] = (ords, scores, total)
+        self._result_cache.move_to_end(key)
+        if len(self._result_cache) > self.RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+
+        return ords[start:stop], scores[start:stop], total
+
+    def search_page(self, search_query: str, corpus: dict, offset: int = 0, limit: int = 20):
+        """
+        Rank the query and return a single page of lightweight hits.
 
         :param search_query: user query string
-        :param search_id: id returned by AnalyticsData.save_query_terms
         :param corpus: dict[pid -> Document]
-        :param num_results: how many top results to return
-        :return: list[ResultItem]
+        :param offset: rank of the first hit in the page (0-based)
+        :param limit: page size
+        :return: ResultPage
         """
-        print("Search query:", search_query)
-
         if not self._indexed:
             self._build_index(corpus)
+        self._maybe_reload_prior()
 
-        terms = self._tokenize(search_query)
-        if not terms:
-            return []
+        offset = max(0, offset)
+        limit = max(0, limit)
 
-        # Soft matching: docs that contain any of the query terms
-        candidates = set()
-        for t in terms:
-            if t in self._index:
-                candidates |= {pid for pid, _ in self._index[t]}
+        query_key = normalize_query(search_query)
+        if not query_key:
+            return ResultPage(hits=[], total=0, offset=offset, next_offset=None,
+                              ranking_version=self._ranking_version)
 
-        if not candidates:
-            return []
+        ords, scores, total = self._ranked_range(query_key, offset, offset + limit)
+        page = [RankedHit(self._doc_ids[i], score)
+                for i, score in zip(ords.tolist(), scores.tolist())]
+        next_offset = offset + limit if offset + limit < total else None
+        return ResultPage(hits=page, total=total, offset=offset, next_offset=next_offset,
+                          ranking_version=self._ranking_version)
 
-        scores = self._bm25_scores(terms, candidates)
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:num_results]
+    # ---------- Display hydration ----------
 
+    def _doc_url(self, pid, search_id, search_query):
+        """
+        Internal link to our Flask detail page. It carries the query so the click is
+        credited to the search it came from (search_id only when the search was recorded).
+        """
+        params = {"pid": pid, "q": search_query}
+        if search_id is not None:
+            params["search_id"] = search_id
+        return "doc_details?" + urlencode(params)
+
+    def hydrate(self, hits, search_id, search_query: str, corpus: dict):
+        """
+        Build the full ResultItem objects (used by templates and RAG) for a page of hits.
+        """
         results = []
-        for pid, score in ranked:
+        for pid, score in hits:
             doc: Document = corpus[pid]
 
-            # internal link (goes to our Flask detail page)
-            internal_url = f"doc_details?pid={pid}&search_id={search_id}"
-
             result = ResultItem(
                 pid=doc.pid,
                 title=doc.title,
                 description=doc.description,
-                url=internal_url,
+                url=self._doc_url(pid, search_id, search_query),
                 ranking=float(score),
                 selling_price=doc.selling_price,
                 discount=doc.discount,
@@ -135,3 +342,44 @@ class SearchEngine:
             results.append(result)
 
         return results
+
+    def to_records(self, hits, search_id, search_query: str, corpus: dict):
+        """
+        Plain-dict records for a page of hits with the same fields as ResultItem,
+        ready for JSON serialization (no pydantic validation round-trip).
+        """
+        records = []
+        for pid, score in hits:
+            doc: Document = corpus[pid]
+            records.append({
+                "pid": doc.pid,
+                "title": doc.title,
+                "description": doc.description,
+                "url": self._doc_url(pid, search_id, search_query),
+                "ranking": float(score),
+                "selling_price": doc.selling_price,
+                "discount": doc.discount,
+                "average_rating": doc.average_rating,
+                "brand": doc.brand,
+                "category": doc.category,
+                "source_url": doc.url,
+                "images": doc.images,
+            })
+        return records
+
+    # ---------- Public search API ----------
+
+    def search(self, search_query: str, search_id: int, corpus: dict, num_results: int = 20):
+        """
+        Main entry point used from web_app.py.
+
+        :param search_query: user query string
+        :param search_id: id returned by AnalyticsData.record_query
+        :param corpus: dict[pid -> Document]
+        :param num_results: how many top results to return
+        :return: list[ResultItem]
+        """
+        print("Search query:", search_query)
+
+        page = self.search_page(search_query, corpus, offset=0, limit=num_results)
+        return self.hydrate(page.hits, search_id, search_query, corpus)
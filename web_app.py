@@ -2,7 +2,7 @@ import os
 from json import JSONEncoder
 
 import httpagentparser  # for getting the user agent as json
-from flask import Flask, render_template, session, request
+from flask import Flask, render_template, session, request, jsonify
 from dotenv import load_dotenv
 
 from myapp.analytics.analytics_data import AnalyticsData, ClickedDoc
@@ -30,16 +30,24 @@ app.secret_key = os.getenv("SECRET_KEY")
 app.session_cookie_name = os.getenv("SESSION_COOKIE_NAME")
 
 
+# -------- Paths -------- #
+full_path = os.path.realpath(__file__)
+path, filename = os.path.split(full_path)
+file_path = path + "/" + os.getenv("DATA_FILE_PATH")
+prior_path = path + "/" + os.getenv("PRIOR_FILE_PATH", "data/popularity_prior.json")
+
+
 # -------- Instantiate engine, analytics, RAG -------- #
-search_engine = SearchEngine()
+search_engine = SearchEngine(
+    prior_path=prior_path,
+    prior_weight=float(os.getenv("PRIOR_WEIGHT", "1.0")),
+    ctr_weight=float(os.getenv("CTR_WEIGHT", "1.0")),
+)
 analytics_data = AnalyticsData()
 rag_generator = RAGGenerator()
 
 
 # -------- Load products corpus -------- #
-full_path = os.path.realpath(__file__)
-path, filename = os.path.split(full_path)
-file_path = path + "/" + os.getenv("DATA_FILE_PATH")
 
 corpus = load_corpus(file_path)
 print("\nCorpus is loaded... \n First element:\n", list(corpus.values())[0])
@@ -84,8 +92,7 @@ def search_form_post():
         )
 
     # --- NEW ANALYTICS ---
-    analytics_data.record_query(search_query)
-    search_id = None
+    search_id = analytics_data.record_query(search_query)
     session['last_search_query'] = search_query
     session['last_search_id'] = search_id
     # ----------------------
@@ -110,6 +117,57 @@ def search_form_post():
     )
 
 
+# =====================================================
+#                   JSON SEARCH API
+# =====================================================
+API_MAX_PAGE_SIZE = 200
+
+
+@app.route('/api/search', methods=['GET'])
+def search_api():
+    """
+    Paginated JSON search: /api/search?q=...&limit=20&cursor=<next_cursor>&search_id=<id>
+
+    The cursor is "<ranking version>:<offset>". If the ranking changed since it was
+    issued (a new popularity prior was loaded), pages could overlap or skip results,
+    so the search restarts from the first page and the response has restarted=true.
+    The first page records the query and returns its search_id, which later pages pass back.
+    """
+    search_query = request.args.get("q", "").strip()
+    cursor = request.args.get("cursor")
+    ranking_version, offset = None, 0
+    try:
+        if cursor:
+            ranking_version, offset = cursor.rsplit(":", 1)
+            offset = max(0, int(offset))
+        limit = min(API_MAX_PAGE_SIZE, max(1, int(request.args.get("limit", "20"))))
+    except ValueError:
+        return jsonify({"error": "invalid cursor or limit"}), 400
+
+    search_id = request.args.get("search_id", type=int)
+    if search_query and not cursor and search_id is None:
+        search_id = analytics_data.record_query(search_query)
+
+    page = search_engine.search_page(search_query, corpus, offset=offset, limit=limit)
+    restarted = ranking_version is not None and ranking_version != page.ranking_version
+    if restarted:
+        page = search_engine.search_page(search_query, corpus, offset=0, limit=limit)
+
+    records = search_engine.to_records(page.hits, search_id, search_query, corpus)
+
+    return jsonify({
+        "query": search_query,
+        "search_id": search_id,
+        "total": page.total,
+        "offset": page.offset,
+        "limit": limit,
+        "restarted": restarted,
+        "next_cursor": (f"{page.ranking_version}:{page.next_offset}"
+                        if page.next_offset is not None else None),
+        "results": records,
+    })
+
+
 
 # =====================================================
 #              DOCUMENT DETAILS + CLICK LOGGING
@@ -117,13 +175,14 @@ def search_form_post():
 @app.route('/doc_details', methods=['GET'])
 def doc_details():
     clicked_doc_id = request.args.get("pid")
-    search_id = request.args.get("search_id")
+    search_id = request.args.get("search_id", type=int)
+    search_query = request.args.get("q")
 
     if not clicked_doc_id or clicked_doc_id not in corpus:
         return render_template('doc_details.html', doc=None)
 
     # NEW analytics
-    analytics_data.record_click(clicked_doc_id)
+    analytics_data.record_click(clicked_doc_id, search_query, search_id)
 
     # full document
     row: Document = corpus[clicked_doc_id]